@@ -8,11 +8,21 @@ For more information, please check README.md
 """
 
 # built-ins
+import asyncio
+import hashlib
+import os
+import shutil
 import tempfile
-import time
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
+from typing import Any, Optional
 
 # 3rd-party
+import faiss
+import httpx
+import openai
 import streamlit as st
 from langchain.agents import AgentExecutor, ConversationalAgent
 from langchain.memory import ConversationBufferWindowMemory
@@ -20,12 +30,70 @@ from langchain.tools.retriever import create_retriever_tool
 from langchain_community.chat_message_histories.streamlit import (
     StreamlitChatMessageHistory,
 )
-from langchain_community.vectorstores.faiss import FAISS
+from langchain_core.exceptions import OutputParserException
 from langchain_openai import ChatOpenAI, OpenAIEmbeddings
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 
 # local
 from utils.langchain_loaders import DocumentLoader
+from utils.langchain_streaming import stream_agent_answer
+from utils.langchain_vector_store import VectorStore
+
+# The connection pool limits of the HTTP clients the OpenAI requests are sent with
+OPENAI_HTTP_LIMITS = httpx.Limits(
+    max_keepalive_connections=32, max_connections=64, keepalive_expiry=60
+)
+
+
+def truncate_parsing_error(parsing_error: OutputParserException) -> str:
+    """
+    Handles the agent's failures to parse its LLM's output, by passing the LLM the start of
+    the error as its next observation.
+
+    Args:
+        parsing_error: The agent's output parsing error.
+
+    Returns:
+        str: The first 50 characters of the error.
+    """
+    return str(parsing_error)[:50]
+
+
+def close_event_loop(
+    loop: asyncio.AbstractEventLoop, transport: httpx.AsyncHTTPTransport
+) -> None:
+    """
+    Closes a session's pooled HTTP connections and then its event loop, once the session
+    ended. Both are closed in a thread of their own, since another event loop may be
+    running in the calling thread.
+
+    Args:
+        loop: The session's event loop.
+        transport: The transport of the session's async HTTP client.
+    """
+
+    def close() -> None:
+        loop.run_until_complete(transport.aclose())
+        loop.close()
+
+    threading.Thread(target=close, daemon=True).start()
+
+
+def discard_failed_file(failed_file_id: str, error_message: str) -> None:
+    """
+    Undoes adding a session file that failed loading or embedding, so the other new files
+    are still indexed, and shows the failure. The failed upload is not retried until the
+    file is uploaded again.
+
+    Args:
+        failed_file_id: The upload ID of the failed file.
+        error_message: The failure to show.
+    """
+    failed_filepath = upload_tmp_dir() / st.session_state.files.pop(failed_file_id)
+    st.session_state.failed_file_ids.add(failed_file_id)
+    st.session_state.filename_stems.pop(failed_filepath.name, None)
+    failed_filepath.unlink(missing_ok=True)
+    st.error(error_message)
 
 
 @st.cache_resource
@@ -40,6 +108,60 @@ def upload_tmp_dir() -> Path:
     return Path(tempfile.mkdtemp())
 
 
+@st.cache_resource
+def text_splitter() -> RecursiveCharacterTextSplitter:
+    """
+    Creates the text splitter used to chunk documents once for the Streamlit app's lifecycle,
+    instead of on every rerun.
+
+    Returns:
+        RecursiveCharacterTextSplitter: The documents' text splitter.
+    """
+    return RecursiveCharacterTextSplitter(chunk_size=1500, chunk_overlap=200)
+
+
+@st.cache_resource
+def loader_pool() -> ThreadPoolExecutor:
+    """
+    Creates the thread pool that loads uploaded documents and caches it for the Streamlit
+    app's lifecycle, so multiple uploaded files are loaded in parallel.
+
+    Returns:
+        ThreadPoolExecutor: The documents' loading thread pool.
+    """
+    return ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 1))
+
+
+@st.cache_resource
+def http_client() -> httpx.Client:
+    """
+    Creates the HTTP client that the synchronous OpenAI requests of all sessions are sent
+    with and caches it for the Streamlit app's lifecycle, so the chat model and embeddings
+    reuse its kept-alive connections instead of each opening (and TLS handshaking) its own.
+
+    Returns:
+        httpx.Client: The shared HTTP client.
+    """
+    return httpx.Client(timeout=60.0, limits=OPENAI_HTTP_LIMITS)
+
+
+@st.cache_resource
+def gpu_resources() -> Optional[Any]:
+    """
+    Allocates FAISS GPU resources and caches them for the Streamlit app's lifecycle, so
+    vector stores keep their index resident in GPU memory across reruns. The resources are
+    shared by the vector stores of all sessions, which use them one at a time.
+
+    Returns:
+        faiss.StandardGpuResources if a CUDA GPU is available, None otherwise (e.g. when
+        running with the faiss-cpu package).
+    """
+    if not hasattr(faiss, "StandardGpuResources") or faiss.get_num_gpus() == 0:
+        return None
+    # pylint: disable-next=no-member  # Missing from faiss-cpu, checked above
+    return faiss.StandardGpuResources()
+
+
 # Set page title
 st.set_page_config(page_title="AI Assistant")
 
@@ -74,6 +196,8 @@ with st.sidebar:
         type=DocumentLoader.supported_doc_extensions(),
         accept_multiple_files=True,
     )
+    # Lists the files recovered from previous sessions, which are not in the uploader
+    recovered_files_container = st.container()
 
     st.markdown("---")
     st.markdown("# About")
@@ -98,16 +222,55 @@ if not openai_api_key:
     st.error("Please input your OpenAI API key in the sidebar.")
     st.stop()
 
-# Initialize OpenAI agent
+if "event_loop" not in st.session_state:
+    # Async OpenAI (and HTTP) clients are bound to the event loop they were first used on, so
+    # the session runs all of its coroutines on a single event loop, and pools the
+    # connections of its asynchronous OpenAI requests in its own client
+    st.session_state.event_loop = asyncio.new_event_loop()
+    async_transport = httpx.AsyncHTTPTransport(limits=OPENAI_HTTP_LIMITS)
+    st.session_state.async_http_client = httpx.AsyncClient(
+        timeout=60.0, transport=async_transport
+    )
+    # Close both once the session ended, and its state (and so its client) was dropped
+    weakref.finalize(
+        st.session_state.async_http_client,
+        close_event_loop,
+        st.session_state.event_loop,
+        async_transport,
+    ).atexit = False
+
+# Initialize OpenAI agent, whose requests share connections with the embeddings' requests
 llm = ChatOpenAI(
-    model_name=model_name, openai_api_key=openai_api_key, temperature=temperature
+    model_name=model_name,
+    openai_api_key=openai_api_key,
+    temperature=temperature,
+    streaming=True,
+    client=openai.OpenAI(
+        api_key=openai_api_key, http_client=http_client()
+    ).chat.completions,
+    async_client=openai.AsyncOpenAI(
+        api_key=openai_api_key, http_client=st.session_state.async_http_client
+    ).chat.completions,
+)
+# Embed up to 2048 chunks (OpenAI's limit) per request, since embedding is network-bound
+embeddings = OpenAIEmbeddings(
+    openai_api_key=openai_api_key,
+    chunk_size=2048,
+    client=openai.OpenAI(
+        api_key=openai_api_key, max_retries=6, http_client=http_client()
+    ).embeddings,
+    async_client=openai.AsyncOpenAI(
+        api_key=openai_api_key,
+        max_retries=6,
+        http_client=st.session_state.async_http_client,
+    ).embeddings,
 )
-embeddings = OpenAIEmbeddings(openai_api_key=openai_api_key)
 
-# Initialize chat history and memory
+# Initialize chat history and memory, passing only the last 6 exchanges to the LLM
 msgs = StreamlitChatMessageHistory()
 memory = ConversationBufferWindowMemory(
     chat_memory=msgs,
+    k=6,
     return_messages=True,
     memory_key="chat_history",
     output_key="output",
@@ -119,115 +282,243 @@ if clear_history:
 
 # Initialize session state variables
 if "files" not in st.session_state:
-    st.session_state.files = []
+    # The names of the session files, by their upload IDs
+    st.session_state.files = {}
+if "failed_file_ids" not in st.session_state:
+    # The upload IDs of the files that failed loading or embedding, skipped while uploaded
+    st.session_state.failed_file_ids = set()
 if "loader" not in st.session_state:
     st.session_state.loader = DocumentLoader()
+if "uploaded_files_hash" not in st.session_state:
+    # The hash of the uploaded files' IDs and sizes, as of their last handling
+    st.session_state.uploaded_files_hash = None
 if "on_change" not in st.session_state:
     st.session_state.on_change = False
+if "vector_store" not in st.session_state:
+    st.session_state.vector_store = VectorStore(
+        embeddings, gpu_resources=gpu_resources()
+    )
+else:
+    # Embed with the OpenAI API key currently entered in the sidebar
+    st.session_state.vector_store.embeddings = embeddings
+# The vector store is saved under the temporary directory, for the user's new sessions to
+# recover it. Users are told apart by (a digest of) their OpenAI API key, so that no user
+# recovers, or overwrites, the files of others
+USER_DIGEST = hashlib.sha256(openai_api_key.encode()).hexdigest()
+if st.session_state.get("user_digest") != USER_DIGEST:
+    # Switch to the user's vector store, on the first run and once another API key is
+    # entered. Once switched, the uploaded files are added again, for the new user
+    if "user_digest" in st.session_state:
+        st.session_state.files = {}
+        st.session_state.failed_file_ids = set()
+        st.session_state.uploaded_files_hash = None
+        st.session_state.on_change = True
+    st.session_state.user_digest = USER_DIGEST
+    st.session_state.vector_store_dir = upload_tmp_dir() / "faiss_store" / USER_DIGEST
+
+    # Recover the files indexed by the user's previous sessions, without re-embedding them
+    st.session_state.vector_store.clear()
+    if st.session_state.vector_store.load(st.session_state.vector_store_dir):
+        st.session_state.on_change = True
+
+    # The stems of the indexed files' names, by their names, to describe the vector tool
+    st.session_state.filename_stems = {
+        name: Path(name).stem for name in st.session_state.vector_store.names
+    }
 if "messages" not in st.session_state:
     st.session_state.messages = []
+if "vector_tool" not in st.session_state:
+    # The retriever searches the session's vector store as its files change, and the
+    # tool's description is updated along with them. Multiple search queries, a query per
+    # line, are searched in a single batch
+    st.session_state.vector_tool = create_retriever_tool(
+        retriever=st.session_state.vector_store.as_retriever(),
+        name="vector-tool",
+        description="Useful for searching information about uploaded files",
+    )
 if "agent" not in st.session_state:
+    # The agent is created once, its tools are updated in place as files change
     st.session_state.agent = AgentExecutor.from_agent_and_tools(
         agent=ConversationalAgent.from_llm_and_tools(llm=llm, tools=[]),
         tools=[],
         memory=memory,
-        handle_parsing_errors=lambda error: str(error)[:50],
+        handle_parsing_errors=truncate_parsing_error,
     )
+else:
+    # Apply the model and temperature currently chosen in the sidebar
+    st.session_state.agent.agent.llm_chain.llm = llm
 
 # Display chat history
 for message in st.session_state.messages:
     with st.chat_message(message["role"]):
         st.markdown(message["content"])
 
-# Handle file uploads
-for file in uploaded_files:
-    if file not in st.session_state.files:
-        # Add file to the session files
-        st.session_state.files.append(file)
+# Detect added and removed files by their upload IDs, unless the uploaded files are unchanged
+# since the last rerun (e.g. on every chat message), to skip diffing them altogether
+uploaded_files_hash = hash(
+    frozenset((file.file_id, file.size) for file in uploaded_files)
+)
+if uploaded_files_hash == st.session_state.uploaded_files_hash:
+    added_file_ids, removed_file_ids = set(), set()
+else:
+    uploaded_file_ids = {file.file_id for file in uploaded_files}
+    added_file_ids = (
+        uploaded_file_ids
+        - st.session_state.files.keys()
+        - st.session_state.failed_file_ids
+    )
+    removed_file_ids = st.session_state.files.keys() - uploaded_file_ids
+    # Forget the failed files removed from the uploader, re-uploading them is retried
+    st.session_state.failed_file_ids &= uploaded_file_ids
 
-        # Create temporary file path
-        temp_filepath = upload_tmp_dir() / file.name
+# Handle file removals
+for file_id in removed_file_ids:
+    # Remove this file from the session files
+    filename = st.session_state.files.pop(file_id)
 
-        # Save temporary file
-        with temp_filepath.open("wb") as temp_file:
-            temp_file.write(file.getvalue())
+    # Create temporary file path
+    temp_filepath = upload_tmp_dir() / filename
 
-        # Load document
-        st.session_state.loader.load(temp_filepath)
+    # Remove this file from the session vector store
+    st.session_state.vector_store.remove(filename)
+    st.session_state.filename_stems.pop(filename, None)
 
-        # Set on_change to True to initialize the vector store
-        st.session_state.on_change = True
+    # Remove temporary file
+    temp_filepath.unlink()
 
-# Handle file removals
-for file in st.session_state.files:
-    if file not in uploaded_files:
-        # Create temporary file path
-        temp_filepath = upload_tmp_dir() / file.name
-
-        # Remove this file from the session loader
-        st.session_state.loader.remove(temp_filepath)
+    # Set on_change to True to update the agent
+    st.session_state.on_change = True
 
-        # Remove temporary file
-        temp_filepath.unlink()
+# Handle file uploads
+# The temporary file paths of the files to load, by their upload IDs
+new_filepaths = {}
+added_file_digests = {}
+for file in uploaded_files:
+    if file.file_id in added_file_ids:
+        # Add file to the session files
+        st.session_state.files[file.file_id] = file.name
+        st.session_state.filename_stems[file.name] = Path(file.name).stem
 
-        # Remove this file from the session files
-        st.session_state.files.remove(file)
+        # Create temporary file path
+        temp_filepath = upload_tmp_dir() / file.name
 
-        # Set on_change to True to initialize the vector store
+        # Save temporary file, copying it in 1 MiB blocks rather than as a whole
+        file.seek(0)
+        with temp_filepath.open("wb") as temp_file:
+            shutil.copyfileobj(file, temp_file, length=1024 * 1024)
+
+        # Load the document, unless the same content was recovered already indexed
+        added_file_digests[file.name] = hashlib.sha256(file.getbuffer()).hexdigest()
+        if (
+            st.session_state.vector_store.digest(file.name)
+            != added_file_digests[file.name]
+        ):
+            # Replace a different file, if any, that was recovered under the same name
+            st.session_state.vector_store.remove(file.name)
+            new_filepaths[file.file_id] = temp_filepath
+
+        # Set on_change to True to update the agent
         st.session_state.on_change = True
 
-# Update vector store if there are changes in files
-if st.session_state.on_change:
-    with st.spinner("Uploading files..."):
-        if st.session_state.loader.size > 0:
-            # Split documents
-            text_splitter = RecursiveCharacterTextSplitter(
-                chunk_size=1500, chunk_overlap=200
+# Load the new files in parallel, splitting each one as soon as it is loaded
+new_documents = {}
+if new_filepaths:
+    progress_bar = st.progress(0.0, text="Loading files...")
+    futures = {
+        loader_pool().submit(st.session_state.loader.load, temp_filepath): file_id
+        for file_id, temp_filepath in new_filepaths.items()
+    }
+    for loaded_count, future in enumerate(as_completed(futures), start=1):
+        file_id = futures[future]
+        temp_filepath = new_filepaths[file_id]
+        try:
+            future.result()
+        except Exception as load_error:  # pylint: disable=broad-exception-caught
+            discard_failed_file(
+                file_id, f"Failed loading {temp_filepath.name}: {load_error}"
             )
-            documents = text_splitter.split_documents(st.session_state.loader.documents)
-
-            # Create a vector store
-            vector = FAISS.from_documents(documents, embeddings)
-
-            # Create a vector tool for agent
-            FILENAME_STR = ", ".join(
-                [file.name.split(".")[0] for file in uploaded_files]
+        else:
+            # Split the document, its chunks are embedded with the other new files. The
+            # loaded document is popped, so the loader does not keep its full text
+            chunks = text_splitter().split_documents(
+                st.session_state.loader.pop(temp_filepath)
             )
-            vector_tool = create_retriever_tool(
-                retriever=vector.as_retriever(),
-                name="vector-tool",
-                description=f"Useful for searching information about {FILENAME_STR}",
+            if chunks:
+                new_documents[temp_filepath.name] = chunks
+            else:
+                # Nothing to index, so the vector tool is not described by the file
+                st.session_state.filename_stems.pop(temp_filepath.name, None)
+                st.warning(f"{temp_filepath.name} has no text to search")
+        progress_bar.progress(
+            loaded_count / len(futures), text=f"Loaded {temp_filepath.name}"
+        )
+    progress_bar.empty()
+
+# Embed the new files concurrently and add their chunks to the vector store
+if new_documents:
+    with st.spinner("Uploading files..."):
+        errors = st.session_state.event_loop.run_until_complete(
+            st.session_state.vector_store.aadd(new_documents, added_file_digests)
+        )
+    new_file_ids = {
+        temp_filepath.name: file_id for file_id, temp_filepath in new_filepaths.items()
+    }
+    for filename, error in errors.items():
+        discard_failed_file(
+            new_file_ids[filename], f"Failed uploading {filename}: {error}"
+        )
+
+# Remember the handled uploaded files, to skip them until they change
+st.session_state.uploaded_files_hash = uploaded_files_hash
+
+# Handle removals of recovered files, which the uploader cannot remove
+recovered_filenames = sorted(
+    set(st.session_state.vector_store.names) - set(st.session_state.files.values())
+)
+if recovered_filenames:
+    with recovered_files_container:
+        st.markdown("Files recovered from previous sessions:")
+        for filename in recovered_filenames:
+            if st.button(f"Remove {filename}", key=f"remove_recovered_{filename}"):
+                st.session_state.vector_store.remove(filename)
+                st.session_state.filename_stems.pop(filename, None)
+
+                # Set on_change to True to update the agent, and rerun to unlist the file
+                st.session_state.on_change = True
+                st.rerun()
+
+# Update the agent's tools if there are changes in files
+if st.session_state.on_change:
+    with st.spinner("Updating the assistant..."):
+        vector_tool = st.session_state.vector_tool
+        tools = [vector_tool] if st.session_state.vector_store.size > 0 else []
+
+        # Describe the vector tool by the indexed files
+        FILENAME_STR = ", ".join(st.session_state.filename_stems.values())
+        description = (
+            f"Useful for searching information about {FILENAME_STR}. "
+            "Input multiple search queries on separate lines to search them at once"
+        )
+
+        # Re-create the agent's prompt only if its tools, or their descriptions, changed
+        if (
+            st.session_state.agent.tools != tools
+            or vector_tool.description != description
+        ):
+            vector_tool.description = description
+            st.session_state.agent.tools = tools
+            st.session_state.agent.agent.allowed_tools = [tool.name for tool in tools]
+            st.session_state.agent.agent.llm_chain.prompt = (
+                ConversationalAgent.create_prompt(tools)
             )
 
-            # Initialize agent with the vector tool
-            st.session_state.agent = AgentExecutor.from_agent_and_tools(
-                agent=ConversationalAgent.from_llm_and_tools(
-                    llm=llm, tools=[vector_tool]
-                ),
-                tools=[vector_tool],
-                memory=memory,
-                handle_parsing_errors=lambda error: str(error)[:50],
-            )
-        else:
-            # Initialize agent without the vector tool
-            st.session_state.agent = AgentExecutor.from_agent_and_tools(
-                agent=ConversationalAgent.from_llm_and_tools(llm=llm, tools=[]),
-                tools=[],
-                memory=memory,
-                handle_parsing_errors=lambda error: str(error)[:50],
-            )
+        # Save the vector store, so new sessions recover it without re-embedding. The
+        # concurrent sessions of a user save to the same directory, the last save wins
+        st.session_state.vector_store.save(st.session_state.vector_store_dir)
     st.session_state.on_change = False
     st.toast("Files were updated successfully.")
 
 
-# Function to stream the response for a more interactive chat experience
-def stream_response(res):
-    """Stream the response for a more interactive chat experience."""
-    for word in res.split(" "):
-        yield word + " "
-        time.sleep(0.02)
-
-
 # The following appears also in the examples/streamlit_open_ai.py file
 # For now, we disable pylint's check for similar code in different files
 # pylint: disable=R0801
@@ -240,7 +531,11 @@ if prompt := st.chat_input("Type your message here..."):
         st.markdown(prompt)
 
     with st.chat_message("assistant"):
-        stream_res = stream_response(st.session_state.agent.invoke(prompt)["output"])
-        response = st.write_stream(stream_res)
+        # Stream the answer's tokens as they are generated by the model
+        response = st.write_stream(
+            stream_agent_answer(
+                st.session_state.agent, prompt, st.session_state.event_loop
+            )
+        )
 
     st.session_state.messages.append({"role": "assistant", "content": response})
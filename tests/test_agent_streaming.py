@@ -0,0 +1,74 @@
+"""
+This module contains tests for the stream_agent_answer function, which is responsible for
+streaming a conversational agent's answer as its LLM generates it.
+
+The tests use a fake chat model, so no requests are sent to OpenAI.
+"""
+
+# built-ins
+import asyncio
+from typing import List
+
+# 3rd-party
+import pytest
+from langchain.agents import AgentExecutor, ConversationalAgent
+from langchain.memory import ConversationBufferWindowMemory
+from langchain_community.chat_message_histories.in_memory import ChatMessageHistory
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.tools import Tool
+
+# local
+from utils.langchain_streaming import stream_agent_answer
+
+TOOL_CALL = "Thought: Do I need to use a tool? Yes\nAction: echo\nAction Input: hello"
+ANSWER = "Thought: Do I need to use a tool? No\nAI: Hello there, how are you?"
+
+
+def _agent(llm_outputs: List[str], max_iterations: int = 15) -> AgentExecutor:
+    """Helper function to create an agent whose LLM generates the given outputs."""
+    llm = GenericFakeChatModel(
+        messages=iter([AIMessage(content=output) for output in llm_outputs])
+    )
+    tools = [Tool(name="echo", func=lambda text: text, description="Echoes text")]
+    return AgentExecutor.from_agent_and_tools(
+        agent=ConversationalAgent.from_llm_and_tools(llm=llm, tools=tools),
+        tools=tools,
+        memory=ConversationBufferWindowMemory(
+            chat_memory=ChatMessageHistory(),
+            return_messages=True,
+            memory_key="chat_history",
+            output_key="output",
+        ),
+        max_iterations=max_iterations,
+    )
+
+
+# pylint: disable=redefined-outer-name
+@pytest.fixture
+def loop() -> asyncio.AbstractEventLoop:
+    """Fixture to create a new event loop."""
+    return asyncio.new_event_loop()
+
+
+def test_stream_answer(loop: asyncio.AbstractEventLoop) -> None:
+    """Test streaming an answer token by token, while the agent remembers it."""
+    agent = _agent([ANSWER])
+    tokens = list(stream_agent_answer(agent, "hi", loop))
+    assert len(tokens) > 1, "Expected the answer to be streamed in multiple tokens"
+    assert "".join(tokens) == "Hello there, how are you?"
+    assert isinstance(agent.memory, ConversationBufferWindowMemory)
+    assert agent.memory.chat_memory.messages[-1].content == "Hello there, how are you?"
+
+
+def test_stream_answer_after_tool(loop: asyncio.AbstractEventLoop) -> None:
+    """Test that only the answer is streamed, without the LLM's tool calls."""
+    tokens = list(stream_agent_answer(_agent([TOOL_CALL, ANSWER]), "hi", loop))
+    assert "".join(tokens) == "Hello there, how are you?"
+
+
+def test_stream_output_without_answer(loop: asyncio.AbstractEventLoop) -> None:
+    """Test that the agent's output is streamed when its LLM writes no answer."""
+    agent = _agent([TOOL_CALL], max_iterations=1)
+    tokens = list(stream_agent_answer(agent, "hi", loop))
+    assert tokens == ["Agent stopped due to iteration limit or time limit."]
@@ -9,6 +9,7 @@ get the list of supported document extensions.
 """
 
 # built-ins
+import zipfile
 from pathlib import Path
 
 # 3rd-party
@@ -54,6 +55,46 @@ def test_remove_file(document_loader: DocumentLoader) -> None:
     assert document_loader.size == 0, "Expected size to be 0 after removing the file"
 
 
+def test_get_file(document_loader: DocumentLoader) -> None:
+    """Test getting the documents of a loaded file."""
+    file_path = TEST_FILES_PATH / "test_file.txt"
+    document_loader.load(file_path)
+    assert len(document_loader.get(file_path)) == 1, "Expected 1 document for the file"
+    assert document_loader.get(TEST_FILES_PATH / "other.txt") == []
+
+
+def test_pop_file(document_loader: DocumentLoader) -> None:
+    """Test popping the documents of a loaded file."""
+    file_path = TEST_FILES_PATH / "test_file.txt"
+    document_loader.load(file_path)
+    docs = document_loader.get(file_path)
+    assert document_loader.pop(file_path) == docs, "Expected the file's documents"
+    assert document_loader.size == 0, "Expected size to be 0 after popping the file"
+    assert document_loader.pop(file_path) == [], "Expected no documents to be left"
+
+
+def test_get_file_sharing_stem(document_loader: DocumentLoader, tmp_path: Path) -> None:
+    """Test that files sharing a stem, but not a format, are got and removed apart."""
+    txt_path = tmp_path / "report.txt"
+    txt_path.write_text("text report", encoding="utf-8")
+    docx_path = tmp_path / "report.docx"
+    with zipfile.ZipFile(docx_path, "w") as docx_file:
+        docx_file.writestr(
+            "word/document.xml",
+            '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/'
+            '2006/main"><w:body><w:p><w:r><w:t>word report</w:t></w:r></w:p></w:body>'
+            "</w:document>",
+        )
+    document_loader.load(txt_path)
+    document_loader.load(docx_path)
+
+    docs = document_loader.get(docx_path)
+    assert [doc.page_content.strip() for doc in docs] == ["word report"]
+    assert document_loader.remove(txt_path) is True, "Expected remove to return True"
+    assert document_loader.get(txt_path) == [], "Expected the txt file to be removed"
+    assert document_loader.get(docx_path) == docs, "Expected the docx file to be kept"
+
+
 def test_supported_doc_extensions() -> None:
     """Test supported document extensions."""
     expected_extensions = {"txt", "pdf", "docx"}
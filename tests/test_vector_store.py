@@ -0,0 +1,246 @@
+"""
+This module contains tests for the VectorStore class, which is responsible for
+incrementally indexing the documents of uploaded files in a FAISS vector store.
+
+The tests use a fake embeddings model, so no requests are sent to OpenAI.
+"""
+
+# built-ins
+import asyncio
+from pathlib import Path
+from typing import List
+
+# 3rd-party
+import faiss
+import numpy as np
+import pytest
+from langchain_community.embeddings.fake import DeterministicFakeEmbedding
+from langchain_core.documents import Document
+
+# local
+from utils import langchain_vector_store
+from utils.langchain_vector_store import VectorStore
+
+EMBEDDING_SIZE = 16
+
+
+class BrokenFileEmbedding(DeterministicFakeEmbedding):
+    """A fake embeddings model that fails embedding the chunks of broken files."""
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        if any(text.startswith("broken") for text in texts):
+            raise ConnectionError("Failed embedding")
+        return await super().aembed_documents(texts)
+
+
+# pylint: disable=redefined-outer-name
+@pytest.fixture
+def vector_store() -> VectorStore:
+    """Fixture to create a new VectorStore instance."""
+    return VectorStore(
+        BrokenFileEmbedding(size=EMBEDDING_SIZE), dimension=EMBEDDING_SIZE
+    )
+
+
+def _documents(name: str, count: int) -> List[Document]:
+    """Helper function to create the documents (chunks) of a file."""
+    return [
+        Document(page_content=f"{name} chunk {i}", metadata={"source": name})
+        for i in range(count)
+    ]
+
+
+def _add(vector_store: VectorStore, **chunk_counts: int) -> dict:
+    """Helper function to add files, by their number of chunks, to the vector store."""
+    return asyncio.run(
+        vector_store.aadd(
+            {name: _documents(name, count) for name, count in chunk_counts.items()}
+        )
+    )
+
+
+def test_add_files(vector_store: VectorStore) -> None:
+    """Test adding the documents of multiple files."""
+    assert _add(vector_store, a=3, b=2) == {}, "Expected no errors"
+    assert vector_store.size == 2, f"Expected size to be 2, but got {vector_store.size}"
+    assert vector_store.vector.index.ntotal == 5, "Expected 5 indexed chunks"
+
+
+def test_add_indexed_file(vector_store: VectorStore) -> None:
+    """Test that adding an already indexed file does not embed it again."""
+    _add(vector_store, a=3)
+    _add(vector_store, a=3, b=2)
+    assert vector_store.vector.index.ntotal == 5, "Expected 5 indexed chunks"
+
+
+def test_add_broken_file(vector_store: VectorStore) -> None:
+    """Test that a file failing embedding does not prevent adding the other files."""
+    errors = _add(vector_store, a=3, broken=2)
+    assert set(errors) == {"broken"}, "Expected an error for the broken file"
+    assert vector_store.size == 1, "Expected only the valid file to be added"
+    assert vector_store.vector.index.ntotal == 3, "Expected 3 indexed chunks"
+
+
+def test_normalized_inner_product(vector_store: VectorStore) -> None:
+    """Test that chunks are indexed as unit vectors, searched by their inner product."""
+    _add(vector_store, a=3)
+    index = vector_store.vector.index
+    assert index.metric_type == faiss.METRIC_INNER_PRODUCT, "Expected inner product"
+    norms = np.linalg.norm(index.reconstruct_n(0, index.ntotal), axis=1)
+    assert np.allclose(norms, 1.0, atol=1e-5), "Expected normalized vectors"
+
+    docs_and_scores = vector_store.vector.similarity_search_with_score("a chunk 1")
+    doc, score = docs_and_scores[0]
+    assert doc.page_content == "a chunk 1", "Expected an exact match first"
+    assert score == pytest.approx(1.0, abs=1e-5), "Expected a cosine similarity of 1"
+
+
+def test_remove_file(vector_store: VectorStore) -> None:
+    """Test removing a file keeps the documents of the other files searchable."""
+    _add(vector_store, a=3, b=2)
+    assert vector_store.remove("a") is True
+    assert vector_store.size == 1, "Expected size to be 1 after removing a file"
+    assert vector_store.vector.index.ntotal == 2, "Expected 2 indexed chunks"
+
+    docs = vector_store.as_retriever().invoke("b chunk 1")
+    assert {doc.metadata["source"] for doc in docs} == {"b"}
+    assert docs[0].page_content == "b chunk 1", "Expected an exact match first"
+
+
+def test_remove_last_file(vector_store: VectorStore) -> None:
+    """Test removing the last file empties the vector store."""
+    _add(vector_store, a=3)
+    vector_store.remove("a")
+    assert vector_store.size == 0, "Expected size to be 0 after removing the file"
+    assert vector_store.vector.index.ntotal == 0, "Expected an empty index"
+    assert vector_store.as_retriever().invoke("a chunk 1") == []
+
+
+def test_remove_unknown_file(vector_store: VectorStore) -> None:
+    """Test removing a file that was never added."""
+    assert vector_store.remove("a") is False, "Expected remove to return False"
+
+
+def test_clear(vector_store: VectorStore) -> None:
+    """Test that clearing removes all the files, while their retriever stays usable."""
+    retriever = vector_store.as_retriever()
+    _add(vector_store, a=3, b=2)
+    vector_store.clear()
+    assert vector_store.size == 0, "Expected size to be 0 after clearing"
+    assert vector_store.vector.index.ntotal == 0, "Expected an empty index"
+
+    _add(vector_store, c=2)
+    assert [doc.page_content for doc in retriever.invoke("c chunk 1")] == [
+        "c chunk 1",
+        "c chunk 0",
+    ]
+
+
+def test_replace_embeddings(vector_store: VectorStore) -> None:
+    """Test that replaced embeddings embed the documents and the search queries."""
+    embeddings = BrokenFileEmbedding(size=EMBEDDING_SIZE)
+    vector_store.embeddings = embeddings
+    assert vector_store.vector.embedding_function is embeddings
+    _add(vector_store, a=3)
+    assert vector_store.search_batch(["a chunk 2"])[0][0].page_content == "a chunk 2"
+
+
+def test_search_batch(vector_store: VectorStore) -> None:
+    """Test searching multiple queries at once."""
+    _add(vector_store, a=3, b=2)
+    results = vector_store.search_batch(["a chunk 2", "b chunk 0"], k=2)
+    assert len(results) == 2, "Expected the documents of each query"
+    assert [len(docs) for docs in results] == [2, 2], "Expected 2 documents per query"
+    assert results[0][0].page_content == "a chunk 2", "Expected an exact match first"
+    assert results[1][0].page_content == "b chunk 0", "Expected an exact match first"
+
+    async_results = asyncio.run(vector_store.asearch_batch(["a chunk 2", "b chunk 0"]))
+    assert [docs[0] for docs in async_results] == [docs[0] for docs in results]
+
+
+def test_retrieve_multiple_lines(vector_store: VectorStore) -> None:
+    """Test that the retriever searches each line of its query, merging the results."""
+    _add(vector_store, a=3, b=2)
+    docs = vector_store.as_retriever().invoke("a chunk 2\n\nb chunk 0\na chunk 2")
+    assert [doc.page_content for doc in docs[:2]] == ["a chunk 2", "b chunk 0"]
+    assert len(docs) == len(
+        {doc.page_content for doc in docs}
+    ), "Expected no duplicates"
+
+
+def test_file_digests(vector_store: VectorStore) -> None:
+    """Test that files keep the digests they were added with until they are removed."""
+    asyncio.run(
+        vector_store.aadd(
+            {"a": _documents("a", 3), "b": _documents("b", 2)}, {"a": "digest-a"}
+        )
+    )
+    assert vector_store.digest("a") == "digest-a", "Expected the file's digest"
+    assert vector_store.digest("b") is None, "Expected no digest for file b"
+
+    vector_store.remove("a")
+    assert vector_store.digest("a") is None, "Expected no digest after removing it"
+
+
+def test_save_and_load(vector_store: VectorStore, tmp_path: Path) -> None:
+    """Test that a loaded vector store searches and removes the saved files."""
+    asyncio.run(
+        vector_store.aadd(
+            {"a": _documents("a", 3), "b": _documents("b", 2)},
+            {"a": "digest-a", "b": "digest-b"},
+        )
+    )
+    vector_store.save(tmp_path)
+
+    loaded_store = VectorStore(vector_store.embeddings, dimension=EMBEDDING_SIZE)
+    assert loaded_store.load(tmp_path) is True, "Expected load to return True"
+    assert loaded_store.names == ["a", "b"], "Expected the saved files to be loaded"
+    assert (
+        loaded_store.digest("b") == "digest-b"
+    ), "Expected the saved digests to be loaded"
+    assert (
+        loaded_store.as_retriever().invoke("a chunk 2")[0].page_content == "a chunk 2"
+    )
+
+    loaded_store.remove("a")
+    assert loaded_store.vector.index.ntotal == 2, "Expected 2 indexed chunks"
+
+
+def test_save_replaces_saved_store(vector_store: VectorStore, tmp_path: Path) -> None:
+    """Test that saving replaces the store saved to the directory as a whole."""
+    store_dir = tmp_path / "store"
+    _add(vector_store, a=3, b=2)
+    vector_store.save(store_dir)
+    vector_store.remove("a")
+    vector_store.save(store_dir)
+
+    loaded_store = VectorStore(vector_store.embeddings, dimension=EMBEDDING_SIZE)
+    assert loaded_store.load(store_dir) is True, "Expected load to return True"
+    assert loaded_store.names == ["b"], "Expected the last saved files to be loaded"
+    assert loaded_store.vector.index.ntotal == 2, "Expected 2 indexed chunks"
+    assert [path.name for path in tmp_path.iterdir()] == [
+        "store"
+    ], "Expected no leftover directories"
+
+
+def test_load_missing_store(vector_store: VectorStore, tmp_path: Path) -> None:
+    """Test loading from a directory no vector store was saved to."""
+    assert vector_store.load(tmp_path) is False, "Expected load to return False"
+
+
+def test_quantize_large_index(
+    vector_store: VectorStore, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """Test that a growing index is quantized, while its documents stay searchable."""
+    monkeypatch.setattr(langchain_vector_store, "IVFPQ_THRESHOLD", 300)
+    _add(vector_store, a=200)
+    assert faiss.try_extract_index_ivf(vector_store.vector.index) is None
+
+    _add(vector_store, b=200, c=5)
+    assert faiss.try_extract_index_ivf(vector_store.vector.index) is not None
+    assert vector_store.vector.index.ntotal == 405, "Expected 405 indexed chunks"
+
+    vector_store.remove("b")
+    assert vector_store.vector.index.ntotal == 205, "Expected 205 indexed chunks"
+    docs = vector_store.as_retriever().invoke("c chunk 3")
+    assert docs[0].page_content == "c chunk 3", "Expected an exact match first"
@@ -3,14 +3,16 @@ This module contains the DocumentLoader class for loading and storing documents
 formats.
 
 The DocumentLoader supports text, PDF, and Word documents, using loaders defined in the
-langchain_community.document_loaders module. It provides methods to load, remove, and get
-the size of the documents, and to get the list of supported document extensions.
+langchain_community.document_loaders module. It provides methods to load, get, pop, and
+remove documents, to get the size of the documents, and to get the list of supported
+document extensions.
 
 Also defined are two protocols, FileInitializedClass and FileInitializedDocLoader, for
 initializing classes with a file path and BaseLoader classes with a file, respectively.
 """
 
 # built-ins
+import threading
 from pathlib import Path
 from typing import Dict, List, Protocol, Type
 
@@ -61,6 +63,8 @@ class DocumentLoader:
         Initializes an empty list to store the documents.
         """
         self.documents: List[Document] = []
+        # Guards the documents list, since documents may be loaded in other threads
+        self._lock = threading.Lock()
 
     def load(self, doc_path: Path) -> bool:
         """
@@ -75,15 +79,56 @@ class DocumentLoader:
         file_ext = doc_path.suffix[1:]
         try:
             loader: BaseLoader = DocumentLoader._DOC_LOADERS[file_ext](str(doc_path))
-            self.documents.extend(loader.load())
+            documents = loader.load()
+            with self._lock:
+                self.documents.extend(documents)
             return True
         except KeyError:
             print(f"{file_ext} is not supported.")
             return False
 
+    def get(self, doc_path: Path) -> List[Document]:
+        """
+        Gets the documents that were loaded from the specified file path.
+
+        Args:
+            doc_path: The path of the loaded document file.
+
+        Returns:
+            The list of documents loaded from the file (e.g. a document per PDF page).
+        """
+        # Match the exact source, since files of different formats may share a stem
+        doc_source_to_get = str(doc_path)
+        return [
+            doc
+            for doc in self.documents
+            if doc.metadata.get("source") == doc_source_to_get
+        ]
+
+    def pop(self, doc_path: Path) -> List[Document]:
+        """
+        Removes the documents that were loaded from the specified file path and returns them,
+        so the loader does not keep them once they were handed over (e.g. to be split).
+
+        Args:
+            doc_path: The path of the loaded document file.
+
+        Returns:
+            The list of documents loaded from the file, which were removed.
+        """
+        doc_source_to_pop = str(doc_path)
+        with self._lock:
+            popped_docs = self.get(doc_path)
+            self.documents = [
+                doc
+                for doc in self.documents
+                if doc.metadata.get("source") != doc_source_to_pop
+            ]
+        return popped_docs
+
     def remove(self, doc_path: Path) -> bool:
         """
-        Removes a document from the documents list based on its source path.
+        Removes the documents of a file from the documents list based on their source path.
 
         Args:
             doc_path: The path of the document to be removed.
@@ -91,15 +136,7 @@ class DocumentLoader:
         Returns:
             True if the document was successfully removed, False otherwise.
         """
-        found_doc = False
-        doc_filename_to_remove = doc_path.stem
-        for doc in self.documents:
-            doc_filename = Path(doc.metadata.get("source")).stem
-            if doc_filename == doc_filename_to_remove:
-                self.documents.remove(doc)
-                found_doc = True
-                break
-        return found_doc
+        return len(self.pop(doc_path)) > 0
 
     @property
     def size(self) -> int:
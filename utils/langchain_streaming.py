@@ -0,0 +1,84 @@
+"""
+This module contains the stream_agent_answer function for streaming a conversational agent's
+answer as its LLM generates it.
+
+The conversational agent's LLM writes its reasoning and tool calls before its final answer,
+which follows an "AI:" prefix. The tokens of each LLM call are therefore only streamed once
+that prefix was generated, while the LLM's other outputs are left for the agent to parse.
+"""
+
+# built-ins
+import asyncio
+from typing import Dict, Iterator, Set
+
+# 3rd-party
+from langchain.agents import AgentExecutor
+
+
+def stream_agent_answer(
+    agent: AgentExecutor, prompt: str, loop: asyncio.AbstractEventLoop
+) -> Iterator[str]:
+    """
+    Streams the answer of a conversational agent to a prompt, token by token.
+
+    The agent runs on the given event loop, which is only run while waiting for the next
+    token, so the answer can be consumed by synchronous code (e.g. st.write_stream).
+
+    Args:
+        agent: The agent executor of a ConversationalAgent.
+        prompt: The user's prompt.
+        loop: The event loop to run the agent on.
+
+    Yields:
+        The tokens of the agent's answer. If the agent finished without its LLM writing an
+        answer (e.g. it stopped due to its iterations limit), its whole output is yielded.
+    """
+    answer_prefix = f"{getattr(agent.agent, 'ai_prefix', 'AI')}:"
+    events = agent.astream_events(prompt, version="v1")
+    root_run_id = None
+    llm_outputs: Dict[str, str] = {}
+    answer_starts: Dict[str, int] = {}
+    answering_run_ids: Set[str] = set()
+
+    while True:
+        try:
+            event = loop.run_until_complete(anext(events))
+        except StopAsyncIteration:
+            return
+
+        root_run_id = root_run_id or event["run_id"]
+        if event["event"] == "on_chat_model_stream":
+            token = event["data"]["chunk"].content
+            run_id = event["run_id"]
+            if run_id in answering_run_ids:
+                yield token
+                continue
+
+            # Buffer the LLM's output until it starts writing an answer
+            llm_outputs[run_id] = llm_outputs.get(run_id, "") + token
+            if run_id not in answer_starts:
+                # Search only the new token, and the buffer's end it may complete the prefix
+                # with, rather than re-scanning the whole buffer on every token
+                prefix_start = llm_outputs[run_id].find(
+                    answer_prefix,
+                    max(
+                        0,
+                        len(llm_outputs[run_id]) - len(token) - len(answer_prefix) + 1,
+                    ),
+                )
+                if prefix_start == -1:
+                    continue
+                answer_starts[run_id] = prefix_start + len(answer_prefix)
+
+            answer_start = answer_starts[run_id]
+            answer = llm_outputs[run_id][answer_start:]
+            if answer.strip():
+                answering_run_ids.add(run_id)
+                del llm_outputs[run_id]
+                yield answer.lstrip()
+        elif (
+            event["event"] == "on_chain_end"
+            and event["run_id"] == root_run_id
+            and not answering_run_ids
+        ):
+            yield event["data"]["output"]["output"]
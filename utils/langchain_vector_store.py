@@ -0,0 +1,582 @@
+"""
+This module contains the VectorStore class for indexing documents in a FAISS vector store.
+
+The VectorStore keeps a single FAISS index alive across Streamlit reruns and updates it
+incrementally, per source file: adding files embeds only those files' chunks (concurrently,
+a file per embeddings request), and removing a file deletes its chunks from the index
+without re-embedding the remaining ones.
+
+The index is a HNSW graph (IndexHNSWFlat) rather than FAISS's default exhaustive IndexFlatL2,
+so retrieval time grows logarithmically, rather than linearly, with the number of chunks.
+When FAISS GPU resources are given, the index is instead kept resident in GPU memory, where
+an exhaustive search outperforms a HNSW graph searched on the CPU. FAISS GPU resources are
+not safe to use from several threads at once, so the GPU indexes of all the VectorStores
+(e.g. of concurrent Streamlit sessions) are used one at a time.
+
+Once a CPU index grows past IVFPQ_THRESHOLD chunks, it is replaced with an inverted file
+index of product-quantized vectors (IndexIVFPQ), which stores each vector in PQ_M bytes
+rather than its full float32 embedding (6 KB for OpenAI's embeddings).
+
+Embeddings are normalized to unit length when indexed and searched, so all the indexes
+measure similarity by inner product (cosine similarity), a single dot product per vector,
+rather than by L2 distance.
+
+The VectorStore can be saved to, and loaded from, a directory, so a new session can recover
+the indexed files without re-embedding them. Files can be added along with a digest of their
+content, so a file uploaded under the name of a recovered file can be told apart from it.
+
+Also defined is the BatchRetriever, which searches the VectorStore for multiple queries (a
+query per line) at once: the queries are embedded in a single request, and searched in a
+single FAISS search, which FAISS parallelizes across the queries (unlike a single query).
+"""
+
+# built-ins
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+import warnings
+from contextlib import nullcontext
+from itertools import zip_longest
+from pathlib import Path
+from typing import Any, ContextManager, Dict, List, Optional, Sequence
+
+# 3rd-party
+import faiss
+import numpy as np
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores.faiss import FAISS
+from langchain_community.vectorstores.utils import DistanceStrategy
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForRetrieverRun,
+    CallbackManagerForRetrieverRun,
+)
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+
+# FAISS picks its AVX2/AVX512 build according to the CPU, unless FAISS_NO_AVX2 is set, which
+# makes LangChain (e.g. when normalizing vectors or writing indexes) use its generic build
+os.environ.pop("FAISS_NO_AVX2", None)
+
+# The dimension of OpenAI's (ada-002) embeddings
+OPENAI_EMBEDDING_DIMENSION = 1536
+
+# HNSW parameters: the number of neighbors per graph node, and the size of the candidates
+# list explored while building the graph and while searching it (higher is more accurate)
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 64
+
+# IVFPQ parameters: the number of chunks above which vectors are quantized, the number of
+# sub-vectors (bytes) each vector is quantized to, the number of bits per sub-vector, and
+# the number of inverted lists (out of 4 * sqrt(#chunks)) probed while searching
+IVFPQ_THRESHOLD = 10_000
+PQ_M = 8
+PQ_NBITS = 8
+IVF_NPROBE = 16
+
+# The file names of a saved VectorStore: the FAISS index (and its docstore, as saved by
+# FAISS.save_local), and the docstore IDs and content digest of each indexed file
+INDEX_FILENAME = "index.faiss"
+FILES_FILENAME = "files.json"
+
+# Serializes the use of FAISS GPU resources, which are shared by all the GPU indexes
+_GPU_LOCK = threading.RLock()
+
+# Serializes saving and loading vector stores, so no store is loaded while being replaced
+_STORE_LOCK = threading.Lock()
+
+# The number of documents retrieved per search query
+SEARCH_K = 4
+
+
+class VectorStore:
+    """
+    A class to incrementally index the documents of multiple files in a FAISS vector store.
+
+    Attributes:
+        embeddings: The embeddings model used to embed the documents.
+        dimension: The dimension of the embeddings.
+        gpu_resources: The FAISS GPU resources to index on the GPU with, None for the CPU.
+        vector: The underlying FAISS vector store.
+
+    Example usage:
+        store = VectorStore(OpenAIEmbeddings())
+        asyncio.run(store.aadd({"file.txt": documents}, {"file.txt": "<digest>"}))
+        print(store.size)
+        store.search_batch(["first query", "second query"])
+        store.remove("file.txt")
+        print(store.size)
+        store.save(Path("<path/to/dir>"))
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        dimension: int = OPENAI_EMBEDDING_DIMENSION,
+        gpu_resources: Optional[Any] = None,
+    ) -> None:
+        """
+        Initializes an empty vector store.
+
+        Args:
+            embeddings: The embeddings model used to embed the documents.
+            dimension: The dimension of the embeddings.
+            gpu_resources: The FAISS GPU resources (faiss.StandardGpuResources) to keep
+                the index on the GPU with, None to keep it on the CPU.
+        """
+        self._embeddings = embeddings
+        self.dimension = dimension
+        self.gpu_resources = gpu_resources
+        with warnings.catch_warnings():
+            # FAISS warns about normalizing vectors for any metric other than L2 distance,
+            # although normalized inner products are exactly cosine similarities
+            warnings.filterwarnings(
+                "ignore", message="Normalizing L2 is not applicable"
+            )
+            self.vector = FAISS(
+                embedding_function=embeddings,
+                index=self._create_index(),
+                docstore=InMemoryDocstore({}),
+                index_to_docstore_id={},
+                normalize_L2=True,
+                distance_strategy=DistanceStrategy.MAX_INNER_PRODUCT,
+            )
+        self._doc_ids: Dict[str, List[str]] = {}
+        self._digests: Dict[str, str] = {}
+
+    async def aadd(
+        self,
+        documents: Dict[str, List[Document]],
+        digests: Optional[Dict[str, str]] = None,
+    ) -> Dict[str, BaseException]:
+        """
+        Embeds the documents of multiple files concurrently and adds them to the index.
+        Files that are already indexed, or have no documents, are skipped.
+
+        Args:
+            documents: The documents (chunks) to add, by the name of their file.
+            digests: The digests of the files' contents, by their names, if known.
+
+        Returns:
+            The errors of the files that failed embedding (and were not added), by name.
+        """
+        names = [
+            name
+            for name, file_documents in documents.items()
+            if name not in self._doc_ids and file_documents
+        ]
+
+        # Embed each file's chunks at once, all the files concurrently, so the total
+        # latency is the one of the slowest file rather than the sum of all of them
+        results = await asyncio.gather(
+            *[
+                self.embeddings.aembed_documents(
+                    [doc.page_content for doc in documents[name]]
+                )
+                for name in names
+            ],
+            return_exceptions=True,
+        )
+
+        errors: Dict[str, BaseException] = {}
+        texts: List[str] = []
+        vectors: List[List[float]] = []
+        metadatas: List[dict] = []
+        doc_ids: List[str] = []
+        for name, result in zip(names, results):
+            if isinstance(result, BaseException):
+                errors[name] = result
+                continue
+            self._doc_ids[name] = [str(uuid.uuid4()) for _ in documents[name]]
+            if digests and name in digests:
+                self._digests[name] = digests[name]
+            texts.extend(doc.page_content for doc in documents[name])
+            vectors.extend(result)
+            metadatas.extend(doc.metadata for doc in documents[name])
+            doc_ids.extend(self._doc_ids[name])
+
+        # Add the chunks of all the files to the index at once
+        if texts:
+            with self._index_lock():
+                self._quantize_index(vectors)
+                self.vector.add_embeddings(
+                    zip(texts, vectors), metadatas=metadatas, ids=doc_ids
+                )
+        return errors
+
+    def clear(self) -> None:
+        """
+        Removes all the indexed files, keeping the FAISS vector store, so retrievers created
+        beforehand search the (empty) vector store.
+        """
+        with self._index_lock():
+            self.vector.index = self._create_index()
+        self.vector.docstore = InMemoryDocstore({})
+        self.vector.index_to_docstore_id = {}
+        self._doc_ids = {}
+        self._digests = {}
+
+    def remove(self, name: str) -> bool:
+        """
+        Removes the documents of a file from the index.
+
+        Args:
+            name: The name of the file whose documents should be removed.
+
+        Returns:
+            True if the file's documents were removed, False if the file is not indexed.
+        """
+        doc_ids = self._doc_ids.pop(name, None)
+        self._digests.pop(name, None)
+        if doc_ids is None:
+            return False
+
+        with self._index_lock():
+            self._delete(doc_ids)
+        return True
+
+    def save(self, store_dir: Path) -> None:
+        """
+        Saves the index, its documents and the indexed files to a directory, replacing the
+        vector store previously saved to it.
+
+        The vector store is written to a new directory, which then replaces the saved one
+        as a whole, so a loaded vector store never mixes files of different saves. When
+        multiple vector stores are saved to the same directory (e.g. by concurrent sessions
+        of the same user), the last one saved wins.
+
+        Args:
+            store_dir: The directory to save the vector store to.
+        """
+        # GPU indexes cannot be written, so a CPU copy of the index is saved instead
+        index = self.vector.index
+        with self._index_lock():
+            if self.gpu_resources is not None:
+                # pylint: disable-next=no-member  # Missing from faiss-cpu
+                index = faiss.index_gpu_to_cpu(index)
+
+        store_dir.parent.mkdir(parents=True, exist_ok=True)
+        new_dir = Path(
+            tempfile.mkdtemp(prefix=f".{store_dir.name}-", dir=store_dir.parent)
+        )
+        FAISS(
+            embedding_function=self.embeddings,
+            index=index,
+            docstore=self.vector.docstore,
+            index_to_docstore_id=self.vector.index_to_docstore_id,
+        ).save_local(str(new_dir))
+        with (new_dir / FILES_FILENAME).open("w", encoding="utf-8") as files_file:
+            json.dump({"doc_ids": self._doc_ids, "digests": self._digests}, files_file)
+
+        # A directory can only replace an empty one, so the saved one is first moved aside
+        with _STORE_LOCK:
+            old_dir = new_dir.with_name(f"{new_dir.name}-old")
+            if store_dir.exists():
+                os.replace(store_dir, old_dir)
+            os.replace(new_dir, store_dir)
+        shutil.rmtree(old_dir, ignore_errors=True)
+
+    def load(self, store_dir: Path) -> bool:
+        """
+        Loads the index, its documents and the indexed files from a directory, replacing
+        the currently indexed ones.
+
+        Args:
+            store_dir: The directory the vector store was saved to.
+
+        Returns:
+            True if the vector store was loaded, False if no vector store was saved to the
+            directory.
+        """
+        with _STORE_LOCK:
+            if not (store_dir / INDEX_FILENAME).exists():
+                return False
+
+            # The pickled docstore was written by save(), hence it is safe to deserialize
+            vector = FAISS.load_local(
+                str(store_dir), self.embeddings, allow_dangerous_deserialization=True
+            )
+            with (store_dir / FILES_FILENAME).open(encoding="utf-8") as files_file:
+                files = json.load(files_file)
+
+        # Keep the FAISS vector store, so retrievers created beforehand search the loaded one
+        self.vector.index = vector.index
+        if self.gpu_resources is not None:
+            self.vector.index = self._to_gpu(vector.index)
+        self.vector.docstore = vector.docstore
+        self.vector.index_to_docstore_id = vector.index_to_docstore_id
+        self._doc_ids = files["doc_ids"]
+        self._digests = files["digests"]
+        return True
+
+    def search_batch(
+        self, queries: Sequence[str], k: int = SEARCH_K
+    ) -> List[List[Document]]:
+        """
+        Searches the indexed documents most similar to each of multiple queries at once.
+
+        Args:
+            queries: The search queries.
+            k: The number of documents to retrieve per query.
+
+        Returns:
+            The retrieved documents of each query, the most similar first.
+        """
+        if not queries:
+            return []
+        return self._search_vectors(self.embeddings.embed_documents(list(queries)), k)
+
+    async def asearch_batch(
+        self, queries: Sequence[str], k: int = SEARCH_K
+    ) -> List[List[Document]]:
+        """
+        Searches the indexed documents most similar to each of multiple queries at once,
+        embedding the queries asynchronously.
+
+        Args:
+            queries: The search queries.
+            k: The number of documents to retrieve per query.
+
+        Returns:
+            The retrieved documents of each query, the most similar first.
+        """
+        if not queries:
+            return []
+        vectors = await self.embeddings.aembed_documents(list(queries))
+        return self._search_vectors(vectors, k)
+
+    def as_retriever(self) -> "BatchRetriever":
+        """Returns a retriever over the indexed documents"""
+        return BatchRetriever(vector_store=self)
+
+    def digest(self, name: str) -> Optional[str]:
+        """
+        Gets the digest of an indexed file's content.
+
+        Args:
+            name: The name of the indexed file.
+
+        Returns:
+            The digest the file was added with, None if it was added without a digest or is
+            not indexed.
+        """
+        return self._digests.get(name)
+
+    @property
+    def embeddings(self) -> Embeddings:
+        """The embeddings model used to embed the documents and the search queries"""
+        return self._embeddings
+
+    @embeddings.setter
+    def embeddings(self, embeddings: Embeddings) -> None:
+        self._embeddings = embeddings
+        self.vector.embedding_function = embeddings
+
+    @property
+    def names(self) -> List[str]:
+        """The names of the indexed files"""
+        return list(self._doc_ids.keys())
+
+    @property
+    def size(self) -> int:
+        """Size of the VectorStore is considered the number of indexed files"""
+        return len(self._doc_ids)
+
+    def _search_vectors(
+        self, vectors: List[List[float]], k: int
+    ) -> List[List[Document]]:
+        """
+        Searches the indexed documents most similar to each of the (query) vectors, in a
+        single search of the index.
+        """
+        query_vectors = np.array(vectors, dtype=np.float32)
+        faiss.normalize_L2(query_vectors)
+        with self._index_lock():
+            _, positions = self.vector.index.search(query_vectors, k)
+
+        # Positions of -1 pad the results when fewer than k documents are indexed, and the
+        # docstore returns an error message, rather than a document, for unknown IDs
+        results: List[List[Document]] = []
+        for query_positions in positions:
+            documents = [
+                self.vector.docstore.search(self.vector.index_to_docstore_id[position])
+                for position in query_positions
+                if position != -1
+            ]
+            results.append(
+                [document for document in documents if isinstance(document, Document)]
+            )
+        return results
+
+    def _index_lock(self) -> ContextManager:
+        """
+        Returns the lock serializing the use of the GPU for a GPU index, and a context that
+        does not lock for a CPU index.
+        """
+        if self.gpu_resources is not None:
+            return _GPU_LOCK
+        return nullcontext()
+
+    def _create_index(self) -> faiss.Index:
+        """
+        Creates an empty index: a flat index on the GPU when GPU resources are available,
+        and a HNSW index, tuned for searching, on the CPU otherwise.
+        """
+        if self.gpu_resources is not None:
+            # FAISS has no GPU implementation of HNSW, so the GPU scans a flat index
+            gpu_index = self._to_gpu(faiss.IndexFlatIP(self.dimension))
+            # _to_gpu clears gpu_resources when moving fails, falling back to HNSW below
+            if self.gpu_resources is not None:
+                return gpu_index
+
+        index = faiss.IndexHNSWFlat(self.dimension, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+        return index
+
+    def _quantize_index(self, new_vectors: List[List[float]]) -> None:
+        """
+        Replaces a CPU index with an IVFPQ index once adding the new vectors would grow it
+        past IVFPQ_THRESHOLD vectors. The IVFPQ index is trained on both the indexed and the
+        new vectors, but only the indexed vectors are added to it.
+
+        Args:
+            new_vectors: The vectors about to be added to the index.
+        """
+        index = self.vector.index
+        if (
+            self.gpu_resources is not None
+            or faiss.try_extract_index_ivf(index) is not None
+            or index.ntotal + len(new_vectors) <= IVFPQ_THRESHOLD
+        ):
+            return
+
+        # The indexed vectors were normalized when added, the new vectors are normalized
+        # only for training, and again by FAISS when added
+        vectors = index.reconstruct_n(0, index.ntotal)
+        normalized_vectors = np.array(new_vectors, dtype=np.float32)
+        faiss.normalize_L2(normalized_vectors)
+        training_vectors = np.concatenate([vectors, normalized_vectors])
+        quantizer = faiss.IndexFlatIP(self.dimension)
+        index = faiss.IndexIVFPQ(
+            quantizer,
+            self.dimension,
+            int(4 * np.sqrt(len(training_vectors))),
+            PQ_M,
+            PQ_NBITS,
+            faiss.METRIC_INNER_PRODUCT,
+        )
+        # FAISS replaces the SWIG signatures train(n, x) and add(n, x), which pylint sees,
+        # with train(x) and add(x) taking a NumPy array
+        index.train(training_vectors)  # pylint: disable=no-value-for-parameter
+        index.nprobe = IVF_NPROBE
+        index.add(vectors)  # pylint: disable=no-value-for-parameter
+        self.vector.index = index
+
+    def _to_gpu(self, index: faiss.Index) -> faiss.Index:
+        """
+        Moves an index to the GPU. If moving it fails, the index is kept on the CPU, as
+        are all the indexes created afterwards.
+        """
+        try:
+            with _GPU_LOCK:
+                # pylint: disable-next=no-member  # Missing from faiss-cpu
+                return faiss.index_cpu_to_gpu(self.gpu_resources, 0, index)
+        except RuntimeError as error:
+            print(f"Failed moving the index to the GPU, using the CPU: {error}")
+            self.gpu_resources = None
+            return index
+
+    def _delete(self, doc_ids: List[str]) -> None:
+        """
+        Deletes documents from the docstore and their vectors from the index.
+
+        HNSW and GPU indexes do not support removing vectors, and IVF indexes do not shift
+        the IDs of the remaining vectors (as the docstore mapping expects), so the index is
+        rebuilt from the vectors of the remaining documents. Those are read back from the
+        index, thus none of the documents is re-embedded.
+
+        Args:
+            doc_ids: The docstore IDs of the documents to delete.
+        """
+        doc_ids_to_delete = set(doc_ids)
+        index_to_docstore_id = self.vector.index_to_docstore_id
+        kept_positions = [
+            position
+            for position, doc_id in sorted(index_to_docstore_id.items())
+            if doc_id not in doc_ids_to_delete
+        ]
+
+        index = self.vector.index
+        ivf_index = faiss.try_extract_index_ivf(index)
+        if ivf_index is not None:
+            # Reading back the vectors of an IVF index requires mapping IDs to its lists
+            ivf_index.make_direct_map()
+        vectors = index.reconstruct_n(0, index.ntotal)[kept_positions]
+
+        if ivf_index is not None:
+            # An IVF index is emptied rather than re-created, to keep its training
+            index.reset()
+        else:
+            index = self._create_index()
+        if kept_positions:
+            index.add(vectors)
+
+        self.vector.index = index
+        self.vector.docstore.delete(doc_ids)
+        self.vector.index_to_docstore_id = {
+            new_position: index_to_docstore_id[position]
+            for new_position, position in enumerate(kept_positions)
+        }
+
+
+class BatchRetriever(BaseRetriever):
+    """
+    A retriever that searches a VectorStore for each line of its query, in a single batch.
+
+    The documents of all the lines are merged by their rank, the most similar document of
+    each line first, and documents retrieved by several lines are returned once.
+
+    Attributes:
+        vector_store: The VectorStore to search.
+        k: The number of documents to retrieve per line.
+
+    Example usage:
+        retriever = store.as_retriever()
+        retriever.invoke("first query\nsecond query")
+    """
+
+    vector_store: VectorStore
+    k: int = SEARCH_K
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        return self._merge(self.vector_store.search_batch(self._split(query), self.k))
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        return self._merge(
+            await self.vector_store.asearch_batch(self._split(query), self.k)
+        )
+
+    @staticmethod
+    def _split(query: str) -> List[str]:
+        """Splits a query into its non-blank lines"""
+        return [line.strip() for line in query.splitlines() if line.strip()]
+
+    @staticmethod
+    def _merge(results: List[List[Document]]) -> List[Document]:
+        """Merges the documents of multiple queries by their rank, without duplicates"""
+        documents: List[Document] = []
+        for ranked_documents in zip_longest(*results):
+            for document in ranked_documents:
+                if document is not None and document not in documents:
+                    documents.append(document)
+        return documents